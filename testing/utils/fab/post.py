@@ -19,10 +19,20 @@ import difflib
 import weakref
 import gzip
 import bz2
+import functools
+import collections
 
 from fab import logutil
 from fab import jsonutil
 
+# When available, use the C implementation of difflib's
+# SequenceMatcher; _diff() spends almost all its time there.  The
+# output is identical.
+try:
+    from cdifflib import CSequenceMatcher as _SequenceMatcher
+except ImportError:
+    _SequenceMatcher = difflib.SequenceMatcher
+
 # Strings used to mark up files; see also runner.py where it marks up
 # the file names.  The sanitizer is hardwired to recognize CUT & TUC
 # so don't change those strings.
@@ -35,6 +45,75 @@ DONE = CUT + " done " + TUC
 TIMEOUT = "timeout while running test script"
 EXCEPTION = "exception while running test script"
 
+# The same markers as bytes, for searching the (bytes) output files
+# without encoding the markers each time.
+
+DONE_B = DONE.encode()
+TIMEOUT_MARKER_B = (LHS + " " + TIMEOUT).encode()
+
+# Patterns used by TestResult when grubbing through files.  Compile
+# them once, as bytes, so that each grub() doesn't need to encode and
+# look up the regex.
+#
+# When a pattern is a plain literal, it is left as bytes and found
+# using bytes.find() which is far cheaper than the regex engine.
+
+_PRINTF_NULL = b"(null)"
+
+# Checking for control characters, say [^ -~\n], using the regex
+# engine means examining each byte in turn.  Instead delete all the
+# allowed characters using bytes.translate() and see if anything is
+# left.
+
+_PLUTO_PRINTABLE = bytes(range(ord(" "), ord("~") + 1)) + b"\n"
+_CONSOLE_PRINTABLE = bytes(range(ord(" "), ord("~") + 1)) + b"\r\n\t"
+
+def _iscntrl(contents, printable):
+    """Return true if CONTENTS contains characters not in PRINTABLE"""
+    return contents is not None and len(contents.translate(None, printable)) > 0
+
+# The raw console output and pluto.log can be large so, instead of
+# searching them once per pattern, scan each once: the literals are
+# found using bytes.find(), and the remaining patterns are combined
+# into a single alternation where the name of each group that matched
+# identifies what was found.
+
+_PLUTO_LITERALS = {
+    "assert": b"ASSERTION FAILED",
+    "expect": b"EXPECTATION FAILED",
+    "null": _PRINTF_NULL,
+}
+
+_RAW_LITERALS = {
+    "segv": b"SEGFAULT",
+    "gp": b"GPFAULT",
+    "timeout": TIMEOUT_MARKER_B,
+    "done": DONE_B,
+}
+
+# CORE FOUND is only of interest at the start of a line so anchor it
+# (the console can emit a bare \r so allow that as well).  The
+# kernel's Call Trace is left unanchored as it can appear mid-line
+# (for instance after a shell prompt).
+_RAW_SCAN = re.compile(rb"(?P<core>(?:^|\r)CORE FOUND)"
+                       rb"|(?P<kern>\[ *\d+\.\d+\] Call Trace:)",
+                       re.MULTILINE)
+
+# The times found in debug.log; all are found using a single pass.
+#
+#   starting debug log at 2018-08-15 13:00:12.275358
+#   ending debug log at 2018-08-15 13:01:31.602533
+#   stop testing basic-pluto-01 (test 2 of 756) after 79.3 seconds
+#   stop booting domains after 56.9 seconds
+#   stop running scripts east:eastinit.sh ... after 22.4 seconds
+
+_DEBUG_LOG_TIMES = re.compile(rb"starting debug log at (?P<start_time>.*)$"
+                              rb"|ending debug log at (?P<stop_time>.*)$"
+                              rb"|: stop testing .* after (?P<runtime>.*) second"
+                              rb"|: stop booting domains after (?P<boot_time>.*) second"
+                              rb"|: stop running scripts .* after (?P<script_time>.*) second",
+                              re.MULTILINE)
+
 class Resolution:
     PASSED = "passed"
     FAILED = "failed"
@@ -73,7 +152,7 @@ class Resolution:
 # Two maps are maintained:
 #
 # - the ISSUE_HOSTS map is indexed by ISSUE, each ISSUE entry then
-#   contains a list (set?) of hosts
+#   contains a set of hosts
 #
 #   This is so that code can easily determine if a specific issue,
 #   regardless of the HOST, has occurred.  All the programatic
@@ -84,11 +163,14 @@ class Resolution:
 #   dictionary.
 #
 # - the HOST_ISSUES map is indexed by HOST, each HOST entry then
-#   contains a list (set?) of issues
+#   contains a set of issues
 #
 #   This is used to display and dump the issues (__str__(), json()).
 #   It seems that the most user friendly format is:
 #   host:issue,... host:issue:,...
+#
+# Sets are used so that adding an issue is cheap; json() converts
+# them to sorted lists.
 
 class Issues:
 
@@ -121,7 +203,7 @@ class Issues:
     BASELINE_DIFFERENT = "baseline-different"
 
     def __init__(self, logger):
-        # Structure needs to be JSON friendly.
+        # See json() for the JSON friendly structure.
         self._host_issues = {}
         self._issue_hosts = {}
         self._logger = logger
@@ -145,7 +227,7 @@ class Issues:
         return s
 
     def json(self):
-        return self._host_issues
+        return {host: sorted(issues) for host, issues in self._host_issues.items()}
 
     # Programatic collections like interface.  This is indexed by
     # ISSUE so that it is easy to query Issues to see if an ISSUE
@@ -164,26 +246,70 @@ class Issues:
         return self._issue_hosts[issue]
 
     def add(self, issue, host):
-        if not host in self._host_issues:
-            self._host_issues[host] = []
-        if not issue in self._host_issues[host]:
-            self._host_issues[host].append(issue)
-        if not issue in self._issue_hosts:
-            self._issue_hosts[issue] = []
-        if not host in self._issue_hosts[issue]:
-            self._issue_hosts[issue].append(host)
+        self._host_issues.setdefault(host, set()).add(issue)
+        self._issue_hosts.setdefault(issue, set()).add(host)
         self._logger.debug("host %s has issue %s", host, issue)
 
 
 def _strip(s):
-    s = re.sub(rb"[ \t]+", rb"", s)
-    s = re.sub(rb"\n+", rb"\n", s)
-    s = re.sub(rb"^\n", rb"", s)
-    return s
-
-def _whitespace(l, r):
-    """Return true if L and R are the same after stripping white space"""
-    return _strip(l) == _strip(r)
+    # Delete all spaces and tabs, then drop blank lines (which
+    # collapses runs of newlines and removes any leading newline); a
+    # trailing newline is kept.
+    s = s.translate(None, b" \t")
+    stripped = b"\n".join(line for line in s.split(b"\n") if line)
+    if stripped and s.endswith(b"\n"):
+        stripped += b"\n"
+    return stripped
+
+def _non_whitespace(s):
+    return len(s) - s.count(b" ") - s.count(b"\t") - s.count(b"\n")
+
+def _whitespace(l, r, stripped_l=None, stripped_r=None):
+    """Return true if L and R are the same after stripping white space
+
+    STRIPPED_L and STRIPPED_R, when specified, are called to get the
+    already stripped L and R."""
+    # Since _strip() only deletes white space, when L and R contain a
+    # different number of other characters they can't match.
+    if _non_whitespace(l) != _non_whitespace(r):
+        return False
+    l = stripped_l() if stripped_l else _strip(l)
+    r = stripped_r() if stripped_r else _strip(r)
+    return l == r
+
+# Number of context lines unified_diff() includes around each change.
+_DIFF_CONTEXT = 3
+
+def _format_range(start, stop):
+    # Same as difflib's unified range format: "start,length", or just
+    # "start" when the length is one.
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return b"%d" % beginning
+    if not length:
+        beginning -= 1
+    return b"%d,%d" % (beginning, length)
+
+def _grouped_opcodes(codes, n):
+    # Same as SequenceMatcher.get_grouped_opcodes(), but for an
+    # explicit list of CODES.
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2-n), i2, max(j1, j2-n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1+n), j1, min(j2, j1+n)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2-i1 > n+n:
+            group.append((tag, i1, min(i2, i1+n), j1, min(j2, j1+n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2-n), max(j1, j2-n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
 
 def _diff(logger, ln, l, rn, r):
     """Return the difference between two strings"""
@@ -192,38 +318,147 @@ def _diff(logger, ln, l, rn, r):
         # slightly faster path
         logger.debug("_diff '%s' and '%s' fast match", ln, rn)
         return []
+    ll = l.splitlines()
+    rl = r.splitlines()
+    # Console output tends to share a long identical prologue and
+    # epilogue.  Only give difflib the part in between, where the
+    # lines differ, and treat the prologue and epilogue as equal.
+    # The hunks (and their context) are then generated from the full
+    # lists.
+    prefix = 0
+    limit = min(len(ll), len(rl))
+    while prefix < limit and ll[prefix] == rl[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and ll[-1-suffix] == rl[-1-suffix]:
+        suffix += 1
+    if prefix == len(ll) and prefix == len(rl):
+        # only the line endings differ
+        return []
     # compare
-    diff = list(difflib.diff_bytes(difflib.unified_diff,
-                                   l.splitlines(), r.splitlines(),
-                                   fromfile=ln.encode(), tofile=rn.encode(),
-                                   lineterm=rb""))
+    lend = len(ll) - suffix
+    rend = len(rl) - suffix
+    matcher = _SequenceMatcher(None, ll[prefix:lend], rl[prefix:rend])
+    codes = []
+    if prefix:
+        codes.append(("equal", 0, prefix, 0, prefix))
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        codes.append((tag, i1+prefix, i2+prefix, j1+prefix, j2+prefix))
+    if suffix:
+        codes.append(("equal", lend, len(ll), rend, len(rl)))
+    diff = [b"--- " + ln.encode(), b"+++ " + rn.encode()]
+    for group in _grouped_opcodes(codes, _DIFF_CONTEXT):
+        first, last = group[0], group[-1]
+        diff.append(b"@@ -" + _format_range(first[1], last[2]) +
+                    b" +" + _format_range(first[3], last[4]) + b" @@")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                diff.extend(b" " + line for line in ll[i1:i2])
+                continue
+            if tag in ("replace", "delete"):
+                diff.extend(b"-" + line for line in ll[i1:i2])
+            if tag in ("replace", "insert"):
+                diff.extend(b"+" + line for line in rl[j1:j2])
     logger.debug("_diff: %s", diff)
-    if not diff:
-        # Always return a list.
-        return []
     return diff
 
 
-def _sanitize_output(logger, raw_path, test):
+def _sanitize_outputs(logger, raw_paths, test):
+    """Sanitize the RAW_PATHS, a dict indexed by host name
+
+    Returns a dict, indexed by host name, containing either the
+    sanitized output or None.
+
+    All the test's hosts are sanitized in one batch: the sanitizers
+    are all started before waiting on any of them, so that they run
+    concurrently.
+
+    """
     # Run the sanitizer found next to the test_sanitize_directory.
-    command = [
-        test.testing_directory("utils", "sanitizer.sh"),
-        raw_path,
-        test.testing_directory("pluto", test.name)
-    ]
-    logger.debug("sanitize command: %s", command)
-    # Note: It is faster to re-read the file than read the
-    # pre-loaded raw console output.
-    process = subprocess.Popen(command, stdin=subprocess.DEVNULL,
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-    logger.debug("sanitized output:\n%s", stdout)
-    if process.returncode or stderr:
-        # any hint of an error
-        logger.error("sanitize command '%s' failed; exit code %s; stderr: '%s'",
-                     command, process.returncode, stderr.decode("utf8"))
-        return None
-    return stdout
+    test_directory = test.testing_directory("pluto", test.name)
+    processes = {}
+    try:
+        for host_name, raw_path in raw_paths.items():
+            command = [
+                test.testing_directory("utils", "sanitizer.sh"),
+                raw_path,
+                test_directory,
+            ]
+            logger.debug("sanitize command: %s", command)
+            # Note: It is faster to re-read the file than read the
+            # pre-loaded raw console output.
+            processes[host_name] = (command,
+                                    subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.PIPE))
+    except BaseException:
+        # Starting a later sanitizer failed (for instance,
+        # sanitizer.sh isn't executable); reap those already started.
+        for command, process in processes.values():
+            process.kill()
+            process.stdout.close()
+            process.stderr.close()
+            process.wait()
+        raise
+    sanitized_outputs = {}
+    for host_name, (command, process) in processes.items():
+        stdout, stderr = process.communicate()
+        logger.debug("host %s sanitized output:\n%s", host_name, stdout)
+        if process.returncode or stderr:
+            # any hint of an error
+            logger.error("sanitize command '%s' failed; exit code %s; stderr: '%s'",
+                         command, process.returncode, stderr.decode("utf8"))
+            stdout = None
+        sanitized_outputs[host_name] = stdout
+    return sanitized_outputs
+
+
+# A cache of file contents, indexed by path, that is bounded by the
+# total size of the contents (MAX_BYTES) rather than the number of
+# entries.  When full the least recently used contents are dropped.
+#
+# Without this, each TestResult would hang onto every (possibly
+# decompressed) output file it had ever looked at.
+
+def _file_contents_cache_mb(default=64):
+    # This is parsed when fab.post is imported so a bad value must
+    # not raise; that would break kvmrunner and kvmresults.
+    mb = os.environ.get("LSW_POST_CACHE_MB")
+    if mb is None:
+        return default
+    try:
+        return int(mb)
+    except ValueError:
+        logutil.getLogger(__name__).warning("LSW_POST_CACHE_MB '%s' is invalid; using %d",
+                                            mb, default)
+        return default
+
+_FILE_CONTENTS_CACHE_MB = _file_contents_cache_mb()
+
+class _FileContentsCache:
+
+    def __init__(self, max_bytes):
+        self._contents = collections.OrderedDict()
+        self._bytes = 0
+        self._max_bytes = max_bytes
+
+    def __contains__(self, path):
+        return path in self._contents
+
+    def __getitem__(self, path):
+        self._contents.move_to_end(path)
+        return self._contents[path]
+
+    def __setitem__(self, path, contents):
+        if path in self._contents:
+            self._bytes -= len(self._contents.pop(path) or b"")
+        self._contents[path] = contents
+        self._bytes += len(contents or b"")
+        # Never drop the entry just added.
+        while self._bytes > self._max_bytes and len(self._contents) > 1:
+            _, dropped = self._contents.popitem(last=False)
+            self._bytes -= len(dropped or b"")
 
 
 # The TestResult objects are almost, but not quite, an enum. It
@@ -252,9 +487,12 @@ class TestResult:
         self.issues = Issues(self.logger)
         self.diffs = {}
         self.sanitized_output = {}
-        self._file_contents_cache = {}
+        self._stripped_output = {}
+        self._file_contents_cache = _FileContentsCache(_FILE_CONTENTS_CACHE_MB << 20)
+        self._directory_files_cache = {}
         self.output_directory = output_directory or test.output_directory
-        # times
+        # times; see _parse_times()
+        self._times_parsed = False
         self._start_time = None
         self._stop_time = None
         self._runtime = None
@@ -272,151 +510,175 @@ class TestResult:
         # Start out assuming that it passed and then prove otherwise.
         self.resolution.passed()
 
-        # did pluto crash?
-        for host_name in test.host_names:
-            pluto_log_filename = host_name + ".pluto.log"
-            if self.grub(pluto_log_filename, "ASSERTION FAILED"):
-                self.issues.add(Issues.ASSERTION, host_name)
-                self.resolution.failed()
-            if self.grub(pluto_log_filename, "EXPECTATION FAILED"):
-                self.issues.add(Issues.EXPECTATION, host_name)
-                # self.resolution.failed() XXX: allow expection failures?
-            if self.grub(pluto_log_filename, "\(null\)"):
-                self.issues.add(Issues.PRINTF_NULL, host_name)
-                self.resolution.failed()
-            if self.grub(pluto_log_filename, r"[^ -~\n]"):
-                # This won't detect a \n embedded in the middle of a
-                # log line.
-                self.issues.add(Issues.ISCNTRL, host_name)
-                self.resolution.failed()
-
-        # Check the raw console output for problems and that it
-        # matches expected output.
+        # Check each host's pluto.log and raw console output for
+        # problems, then sanitize the console output (all hosts in one
+        # batch), and then check the sanitized output and that it
+        # matches the expected output.
 
+        console_hosts = []
+        unsanitized_paths = {}
         for host_name in test.host_names:
-
-            # Check that the host's raw output is present.
-            #
-            # If there is no output at all then the test crashed badly
-            # (for instance, while trying to boot domains).
-            #
-            # Since things really screwed up, mark the test as
-            # UNRESOLVED and give up.
-
-            raw_output_filename = host_name + ".console.verbose.txt"
-            if self.grub(raw_output_filename) is None:
-                self.issues.add(Issues.OUTPUT_MISSING, host_name)
-                self.resolution.unresolved()
-                # With no raw console output, there's little point in
-                # trying validating it.  Skip remaining tests for this
-                # host.
+            raw_output_path = self._check_raw_output(host_name)
+            if raw_output_path is None:
                 continue
+            console_hosts.append(host_name)
+            # When QUICK, prefer console output sanitized earlier.
+            if quick:
+                sanitized_output_path = os.path.join(self.output_directory,
+                                                     host_name + ".console.txt")
+                sanitized_output = self._file_contents(sanitized_output_path)
+                if sanitized_output is not None:
+                    self.sanitized_output[host_name] = sanitized_output
+                    continue
+            unsanitized_paths[host_name] = raw_output_path
 
-            # Check the host's raw output for signs of a crash.
+        # Sanitize what ever console output there is, all the hosts in
+        # one batch.
+        #
+        # Even when the output is seemingly truncated this is useful.
 
-            self.logger.debug("host %s checking raw console output for signs of a crash",
-                              host_name)
-            if self.grub(raw_output_filename, r"[\r\n]CORE FOUND"):
-                self.issues.add(Issues.CORE, host_name)
-                self.resolution.failed()
-            if self.grub(raw_output_filename, r"SEGFAULT"):
-                self.issues.add(Issues.SEGFAULT, host_name)
-                self.resolution.failed()
-            if self.grub(raw_output_filename, r"GPFAULT"):
-                self.issues.add(Issues.GPFAULT, host_name)
-                self.resolution.failed()
-            if self.grub(raw_output_filename, r"\[ *\d+\.\d+\] Call Trace:"):
-                self.issues.add(Issues.KERNEL, host_name)
-                self.resolution.failed()
+        sanitized_outputs = _sanitize_outputs(self.logger, unsanitized_paths, test)
+        for host_name, sanitized_output in sanitized_outputs.items():
+            if sanitized_output is not None:
+                self.sanitized_output[host_name] = sanitized_output
 
-            # Check that the host's raw output is complete.
-            #
-            # The last thing written to the file should be the DONE
-            # marker.  If not then it could be: a timeout; an
-            # exception; or the test is still in-progress.
+        for host_name in console_hosts:
+            self._check_sanitized_output(host_name, quick)
 
-            logger.debug("host %s checking if raw console output is complete");
+    def _check_raw_output(self, host_name):
+        """Check HOST_NAME's pluto.log and raw console output
 
-            if self.grub(raw_output_filename, LHS + " " + TIMEOUT):
-                # One of the test scripts hung; all the
-                self.issues.add(Issues.TIMEOUT, host_name)
-                self.resolution.failed()
+        Returns the path to the raw console output, or None when it
+        is missing.
 
-            if self.grub(raw_output_filename, DONE) is None:
-                self.issues.add(Issues.OUTPUT_TRUNCATED, host_name)
-                self.resolution.unresolved()
+        """
 
+        # did pluto crash?
 
-            # Sanitize what ever output there is and save it.
-            #
-            # Even when the output is seemingly truncated this is
-            # useful.
+        pluto_log_filename = host_name + ".pluto.log"
+        found = self.scan(pluto_log_filename, literals=_PLUTO_LITERALS)
+        if "assert" in found:
+            self.issues.add(Issues.ASSERTION, host_name)
+            self.resolution.failed()
+        if "expect" in found:
+            self.issues.add(Issues.EXPECTATION, host_name)
+            # self.resolution.failed() XXX: allow expection failures?
+        if "null" in found:
+            self.issues.add(Issues.PRINTF_NULL, host_name)
+            self.resolution.failed()
+        if _iscntrl(self.grub(pluto_log_filename), _PLUTO_PRINTABLE):
+            # This won't detect a \n embedded in the middle of a
+            # log line.
+            self.issues.add(Issues.ISCNTRL, host_name)
+            self.resolution.failed()
+
+        # Check that the host's raw output is present.
+        #
+        # If there is no output at all then the test crashed badly
+        # (for instance, while trying to boot domains).
+        #
+        # Since things really screwed up, mark the test as
+        # UNRESOLVED and give up.
+
+        raw_output_filename = host_name + ".console.verbose.txt"
+        if self.grub(raw_output_filename) is None:
+            self.issues.add(Issues.OUTPUT_MISSING, host_name)
+            self.resolution.unresolved()
+            # With no raw console output, there's little point in
+            # trying validating it.  Skip remaining tests for this
+            # host.
+            return None
 
-            sanitized_output_path = os.path.join(self.output_directory,
-                                                 host_name + ".console.txt")
-            self.logger.debug("host %s sanitize console output '%s'",
-                              host_name, sanitized_output_path)
-            sanitized_output = None
-            if quick:
-                sanitized_output = self._file_contents(sanitized_output_path)
-            if sanitized_output is None:
-                sanitized_output = _sanitize_output(self.logger,
-                                                    os.path.join(self.output_directory, raw_output_filename),
-                                                    test)
-            if sanitized_output is None:
-                self.issues.add(Issues.SANITIZER_FAILED, host_name)
-                self.resolution.unresolved()
-                continue
-            self.sanitized_output[host_name] = sanitized_output
+        # Check the host's raw output for signs of a crash and that
+        # it is complete.
+        #
+        # The last thing written to the file should be the DONE
+        # marker.  If not then it could be: a timeout; an exception;
+        # or the test is still in-progress.
+
+        self.logger.debug("host %s checking raw console output for signs of a crash and completeness",
+                          host_name)
+        found = self.scan(raw_output_filename, _RAW_SCAN, _RAW_LITERALS)
+        if "core" in found:
+            self.issues.add(Issues.CORE, host_name)
+            self.resolution.failed()
+        if "segv" in found:
+            self.issues.add(Issues.SEGFAULT, host_name)
+            self.resolution.failed()
+        if "gp" in found:
+            self.issues.add(Issues.GPFAULT, host_name)
+            self.resolution.failed()
+        if "kern" in found:
+            self.issues.add(Issues.KERNEL, host_name)
+            self.resolution.failed()
+        if "timeout" in found:
+            # One of the test scripts hung; all the
+            self.issues.add(Issues.TIMEOUT, host_name)
+            self.resolution.failed()
+        if not "done" in found:
+            self.issues.add(Issues.OUTPUT_TRUNCATED, host_name)
+            self.resolution.unresolved()
+
+        return os.path.join(self.output_directory, raw_output_filename)
+
+    def _check_sanitized_output(self, host_name, quick):
+        test = self.test
+
+        sanitized_output = self.sanitized_output.get(host_name)
+        if sanitized_output is None:
+            self.issues.add(Issues.SANITIZER_FAILED, host_name)
+            self.resolution.unresolved()
+            return
 
-            if self.grep(sanitized_output, r"\(null\)"):
-                self.issues.add(Issues.PRINTF_NULL, host_name)
-                self.resolution.failed()
+        if self.grep(sanitized_output, _PRINTF_NULL):
+            self.issues.add(Issues.PRINTF_NULL, host_name)
+            self.resolution.failed()
+
+        if _iscntrl(sanitized_output, _CONSOLE_PRINTABLE):
+            # Console contains \r\n; this won't detect \n embedded in
+            # the middle of a log line.  Audit emits embedded escapes!
+            self.issues.add(Issues.ISCNTRL, host_name)
+            self.resolution.failed()
+
+        expected_output_path = test.testing_directory("pluto", test.name,
+                                                      host_name + ".console.txt")
+        self.logger.debug("host %s comparing against known-good output '%s'",
+                          host_name, expected_output_path)
+
+        expected_output = self._file_contents(expected_output_path)
+        if expected_output is None:
+            self.issues.add(Issues.OUTPUT_UNCHECKED, host_name)
+            self.resolution.unresolved()
+            return
 
-            if self.grep(sanitized_output, r"[^ -~\r\n\t]"):
-                # Console contains \r\n; this won't detect \n embedded
-                # in the middle of a log line.  Audit emits embedded
-                # escapes!
-                self.issues.add(Issues.ISCNTRL, host_name)
+        diff = None
+        diff_filename = host_name + ".console.diff"
+
+        if quick:
+            # Try to load the existing diff file.  Like _diff() save
+            # a list of lines.
+            diff = self._file_contents(os.path.join(self.output_directory, diff_filename))
+            if diff is not None:
+                diff = diff.splitlines()
+        if diff is None:
+            # use brute force
+            diff = _diff(self.logger,
+                         "MASTER/" + test.directory + "/" + host_name + ".console.txt",
+                         expected_output,
+                         "OUTPUT/" + test.directory + "/" + host_name + ".console.txt",
+                         sanitized_output)
+
+        if diff:
+            self.diffs[host_name] = diff
+            whitespace = _whitespace(expected_output,
+                                     sanitized_output,
+                                     stripped_r=functools.partial(self.stripped_output, host_name))
+            if whitespace:
+                self.issues.add(Issues.OUTPUT_WHITESPACE, host_name)
                 self.resolution.failed()
-
-            expected_output_path = test.testing_directory("pluto", test.name,
-                                                          host_name + ".console.txt")
-            self.logger.debug("host %s comparing against known-good output '%s'",
-                              host_name, expected_output_path)
-
-            expected_output = self._file_contents(expected_output_path)
-            if expected_output is None:
-                self.issues.add(Issues.OUTPUT_UNCHECKED, host_name)
-                self.resolution.unresolved()
-                continue
-
-            diff = None
-            diff_filename = host_name + ".console.diff"
-
-            if quick:
-                # Try to load the existing diff file.  Like _diff()
-                # save a list of lines.
-                diff = self.grub(diff_filename)
-                if diff is not None:
-                    diff = diff.splitlines()
-            if diff is None:
-                # use brute force
-                diff = _diff(self.logger,
-                             "MASTER/" + test.directory + "/" + host_name + ".console.txt",
-                             expected_output,
-                             "OUTPUT/" + test.directory + "/" + host_name + ".console.txt",
-                             sanitized_output)
-
-            if diff:
-                self.diffs[host_name] = diff
-                whitespace = _whitespace(expected_output,
-                                         sanitized_output)
+            else:
+                self.issues.add(Issues.OUTPUT_DIFFERENT, host_name)
                 self.resolution.failed()
-                if whitespace:
-                    self.issues.add(Issues.OUTPUT_WHITESPACE, host_name)
-                else:
-                    self.issues.add(Issues.OUTPUT_DIFFERENT, host_name)
 
     def save(self, output_directory=None):
         output_directory = output_directory or self.output_directory
@@ -445,24 +707,56 @@ class TestResult:
                               host_name, diff_pathname)
             with open(diff_pathname, "wb") as f:
                 if diff:
-                    for line in diff:
-                        f.write(line)
-                        f.write(b"\n")
+                    f.write(b"\n".join(diff))
+                    f.write(b"\n")
+
+    def _directory_files(self, dirname):
+        # List (and cache) the files in DIRNAME so that finding which,
+        # if any, compressed variant of a file exists doesn't need a
+        # stat() per suffix.
+        if not dirname in self._directory_files_cache:
+            self.logger.debug("listing files in '%s'", dirname)
+            try:
+                with os.scandir(dirname) as entries:
+                    files = {entry.name for entry in entries if entry.is_file()}
+            except OSError:
+                files = set()
+            self._directory_files_cache[dirname] = files
+        return self._directory_files_cache[dirname]
+
+    def stripped_output(self, host_name):
+        """Return HOST_NAME's sanitized output with white space stripped
+
+        The result is saved so that mortem() comparing against the
+        baseline doesn't strip the same output again."""
+        stripped = self._stripped_output.get(host_name)
+        if stripped is None:
+            stripped = _strip(self.sanitized_output[host_name])
+            self._stripped_output[host_name] = stripped
+        return stripped
 
     def _file_contents(self, path):
         # Find/load the file, and uncompress when needed.
-        if not path in self._file_contents_cache:
-            self.logger.debug("loading contents of '%s'", path)
-            self._file_contents_cache[path] = None
-            for suffix, open_op in [("", open), (".gz", gzip.open), (".bz2", bz2.open),]:
+        if path in self._file_contents_cache:
+            return self._file_contents_cache[path]
+        self.logger.debug("loading contents of '%s'", path)
+        contents = None
+        dirname, basename = os.path.split(path)
+        files = self._directory_files(dirname)
+        for suffix, decompress in [("", None), (".gz", gzip.decompress), (".bz2", bz2.decompress),]:
+            if basename + suffix in files:
                 zippath = path + suffix
-                if os.path.isfile(zippath):
-                    self.logger.debug("loading '%s' into cache", zippath)
-                    with open_op(path, "rb") as f:
-                        self._file_contents_cache[path] = f.read()
-                        self.logger.debug("loaded contents of '%s'", zippath)
-                        break
-        return self._file_contents_cache[path]
+                self.logger.debug("loading '%s' into cache", zippath)
+                # Reading the whole file and then decompressing it in
+                # one go is faster than using the incremental decoder.
+                with open(zippath, "rb") as f:
+                    contents = f.read()
+                if decompress:
+                    contents = decompress(contents)
+                self.logger.debug("loaded contents of '%s'", zippath)
+                break
+        self._file_contents_cache[path] = contents
+        return contents
 
     def grub(self, filename, regex=None, cast=lambda x: x):
         """Grub around FILENAME to find regex"""
@@ -471,15 +765,50 @@ class TestResult:
         contents = self._file_contents(path)
         return self.grep(contents, regex, cast)
 
+    def scan(self, filename, regex=None, literals=None):
+        """Scan FILENAME once, returning the names of what matched
+
+        The names are the keys of the LITERALS found in the file, and
+        the REGEX groups that matched.
+
+        """
+        self.logger.debug("scanning '%s' for %s and '%s'",
+                          filename, literals and list(literals.values()), regex and regex.pattern)
+        path = os.path.join(self.output_directory, filename)
+        contents = self._file_contents(path)
+        found = set()
+        if contents is None:
+            return found
+        if literals:
+            for name, literal in literals.items():
+                if contents.find(literal) >= 0:
+                    found.add(name)
+        for match in (regex.finditer(contents) if regex else []):
+            found.add(match.lastgroup)
+            if found.issuperset(regex.groupindex):
+                # everything has been seen; stop early
+                break
+        self.logger.debug("scan '%s' found %s", filename, found)
+        return found
+
     def grep(self, contents, regex=None, cast=lambda x: x):
         if contents is None:
             return None
         if regex is None:
             return contents
-        # convert utf-8 regex to bytes
-        byte_regex = regex.encode()
-        self.logger.debug("greping content %s using %s", type(contents), type(byte_regex))
-        match = re.search(byte_regex, contents, re.MULTILINE)
+        # REGEX is either a bytes literal, a pre-compiled bytes
+        # pattern, or a utf-8 string that still needs converting.
+        if isinstance(regex, bytes):
+            self.logger.debug("greping content %s for literal %s", type(contents), regex)
+            if contents.find(regex) < 0:
+                return None
+            result = cast(regex.decode())
+            self.logger.debug("greping result %s", result)
+            return result
+        if isinstance(regex, str):
+            regex = re.compile(regex.encode(), re.MULTILINE)
+        self.logger.debug("greping content %s using %s", type(contents), regex.pattern)
+        match = regex.search(contents)
         if not match:
             return None
         group = match.group(len(match.groups()))
@@ -489,39 +818,53 @@ class TestResult:
         self.logger.debug("greping result %s", result)
         return result
 
+    def _parse_times(self):
+        # Only the first occurrence of each time is used.
+        self._times_parsed = True
+        contents = self.grub("debug.log")
+        if contents is None:
+            return
+        times = {}
+        for match in _DEBUG_LOG_TIMES.finditer(contents):
+            if not match.lastgroup in times:
+                times[match.lastgroup] = match.group(match.lastgroup).decode()
+                if len(times) == len(_DEBUG_LOG_TIMES.groupindex):
+                    break
+        self.logger.debug("debug.log times %s", times)
+        if "start_time" in times:
+            self._start_time = jsonutil.ptime(times["start_time"])
+        if "stop_time" in times:
+            self._stop_time = jsonutil.ptime(times["stop_time"])
+        if "runtime" in times:
+            self._runtime = float(times["runtime"])
+        if "boot_time" in times:
+            self._boot_time = float(times["boot_time"])
+        if "script_time" in times:
+            self._script_time = float(times["script_time"])
+
     def start_time(self):
-        if not self._start_time:
-            # starting debug log at 2018-08-15 13:00:12.275358
-            self._start_time = self.grub("debug.log", r"starting debug log at (.*)$",
-                                   cast=jsonutil.ptime)
+        if not self._times_parsed:
+            self._parse_times()
         return self._start_time
 
     def stop_time(self):
-        if not self._stop_time:
-            # ending debug log at 2018-08-15 13:01:31.602533
-            self._stop_time = self.grub("debug.log", r"ending debug log at (.*)$",
-                                        cast=jsonutil.ptime)
+        if not self._times_parsed:
+            self._parse_times()
         return self._stop_time
 
     def runtime(self):
-        if not self._runtime:
-            # stop testing basic-pluto-01 (test 2 of 756) after 79.3 seconds
-            self._runtime = self.grub("debug.log", r": stop testing .* after (.*) second",
-                                cast=float)
+        if not self._times_parsed:
+            self._parse_times()
         return self._runtime
 
     def boot_time(self):
-        if not self._boot_time:
-            # stop booting domains after 56.9 seconds
-            self._boot_time = self.grub("debug.log", r": stop booting domains after (.*) second",
-                                  cast=float)
+        if not self._times_parsed:
+            self._parse_times()
         return self._boot_time
 
     def script_time(self):
-        if not self._script_time:
-            # stop running scripts east:eastinit.sh ... after 22.4 seconds
-            self._script_time = self.grub("debug.log", r": stop running scripts .* after (.*) second",
-                                    cast=float)
+        if not self._times_parsed:
+            self._parse_times()
         return self._script_time
 
 
@@ -608,14 +951,17 @@ def mortem(test, args, domain_prefix="",
             test_result.issues.add(Issues.BASELINE_PASSED, host_name)
             continue
 
+        baseline_output = baseline_result.sanitized_output[host_name]
+        test_output = test_result.sanitized_output[host_name]
         baseline_diff = _diff(logger,
                               "BASELINE/" + test.directory + "/" + host_name + ".console.txt",
-                              baseline_result.sanitized_output[host_name],
+                              baseline_output,
                               "OUTPUT/" + test.directory + "/" + host_name + ".console.txt",
-                              test_result.sanitized_output[host_name])
+                              test_output)
         if baseline_diff:
-            baseline_whitespace = _whitespace(baseline_result.sanitized_output[host_name],
-                                              test_result.sanitized_output[host_name])
+            baseline_whitespace = _whitespace(baseline_output, test_output,
+                                              functools.partial(baseline_result.stripped_output, host_name),
+                                              functools.partial(test_result.stripped_output, host_name))
             if baseline_whitespace:
                 test_result.issues.add(Issues.BASELINE_WHITESPACE, host_name)
             else: